@@ -0,0 +1,118 @@
+"""Flat byte-level lexing kernel for the grammar in main.py.
+
+The per-token cursor machinery in main.py pays interpreter overhead for
+every character. This module implements the same grammar as one loop
+over a uint8 buffer, written so that numba can compile it: when numba
+and numpy are installed the kernel is lowered to native code with
+@njit, otherwise the identical code runs as plain Python over bytes.
+
+The grammar is ASCII-only outside of string bodies; the kernel works in
+byte offsets, which tokenize maps back to str offsets when the input is
+not pure ASCII.
+"""
+
+from typing import MutableSequence, Sequence
+
+from main import CLASS, IS_BIN, IS_DEC, IS_HEX, IS_QUOTE, ParsingFailed, Token, str_offsets
+
+try:
+    import numba
+    import numpy
+except ImportError:
+    numba = None
+
+STRING, DOT, HEX, BIN, DEC = 0, 1, 2, 3, 4
+TOKEN_TYPES = ("STRING", "DOT", "HEX", "BIN", "DEC")
+
+_CLASS = CLASS
+
+
+def _lex(
+    buf: Sequence[int],
+    out_ty: MutableSequence[int],
+    out_start: MutableSequence[int],
+    out_end: MutableSequence[int],
+) -> int:
+    """Fill the out arrays with (ty, start, end) triples.
+
+    Returns the token count, or -(index + 1) of the first offending
+    byte when no rule matches.
+    """
+    cls = _CLASS
+    i = 0
+    n = len(buf)
+    count = 0
+    while i < n:
+        c = buf[i]
+        if cls[c] & IS_QUOTE:
+            j = i + 1
+            while j < n and buf[j] != c:
+                j += 1
+            if j >= n:
+                return -i - 1
+            ty = STRING
+            j += 1
+        elif c == 0x2E:  # .
+            ty = DOT
+            j = i + 1
+        elif cls[c] & IS_DEC:
+            if c == 0x30 and i + 2 < n and buf[i + 1] == 0x78 and cls[buf[i + 2]] & IS_HEX:  # 0x
+                ty = HEX
+                j = i + 3
+                while j < n and cls[buf[j]] & IS_HEX:
+                    j += 1
+            elif c == 0x30 and i + 2 < n and buf[i + 1] == 0x62 and cls[buf[i + 2]] & IS_BIN:  # 0b
+                ty = BIN
+                j = i + 3
+                while j < n and cls[buf[j]] & IS_BIN:
+                    j += 1
+            else:
+                ty = DEC
+                j = i + 1
+                while j < n and cls[buf[j]] & IS_DEC:
+                    j += 1
+                if j + 1 < n and buf[j] == 0x2E and cls[buf[j + 1]] & IS_DEC:
+                    j += 2
+                    while j < n and cls[buf[j]] & IS_DEC:
+                        j += 1
+        else:
+            return -i - 1
+
+        out_ty[count] = ty
+        out_start[count] = i
+        out_end[count] = j
+        count += 1
+        i = j
+
+    return count
+
+
+if numba is not None:
+    _CLASS = numpy.frombuffer(CLASS, dtype=numpy.uint8)
+    _lex = numba.njit(cache=True)(_lex)
+
+
+def tokenize(text: str) -> list[Token]:
+    buf = text.encode("utf-8")
+    n = len(buf)
+    if numba is not None:
+        out_ty = numpy.empty(n, dtype=numpy.int32)
+        out_start = numpy.empty(n, dtype=numpy.int32)
+        out_end = numpy.empty(n, dtype=numpy.int32)
+        count = _lex(numpy.frombuffer(buf, dtype=numpy.uint8), out_ty, out_start, out_end)
+    else:
+        out_ty = [0] * n
+        out_start = [0] * n
+        out_end = [0] * n
+        count = _lex(buf, out_ty, out_start, out_end)
+
+    if count < 0:
+        raise ParsingFailed(f"No rule matched at index {-count - 1}")
+
+    offsets = str_offsets(text)
+    if offsets is None:
+        return [Token(TOKEN_TYPES[out_ty[k]], text, int(out_start[k]), int(out_end[k])) for k in range(count)]
+
+    return [
+        Token(TOKEN_TYPES[out_ty[k]], text, offsets[int(out_start[k])], offsets[int(out_end[k])]) for k in range(count)
+    ]
@@ -1,65 +1,94 @@
-from abc import ABC, abstractmethod
-from contextlib import contextmanager
-from dataclasses import dataclass, field
-from typing import Callable, Generator
+import re
+import sys
+from types import TracebackType
+from typing import Callable, Generator, Literal, NamedTuple, TypeVar
 
 
-@dataclass
 class Token:
-    ty: str
-    value: str
-    start_index: int
-    end_index: int
+    __slots__ = ("ty", "text", "start_index", "end_index")
+
+    def __init__(self, ty: str, text: str, start_index: int, end_index: int) -> None:
+        self.ty = sys.intern(ty)
+        self.text = text
+        self.start_index = start_index
+        self.end_index = end_index
 
+    @property
+    def value(self) -> str:
+        return self.text[self.start_index : self.end_index]
 
-class EatFailed(Exception):
-    def __init__(self, comment: str, /, failed_on_eof: bool) -> None:
-        super().__init__(comment)
-        self.failed_on_eof = failed_on_eof
+    def __repr__(self) -> str:
+        return (
+            f"Token(ty={self.ty!r}, value={self.value!r}, "
+            f"start_index={self.start_index}, end_index={self.end_index})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return (self.ty, self.value, self.start_index, self.end_index) == (
+            other.ty,
+            other.value,
+            other.start_index,
+            other.end_index,
+        )
 
 
 class ParsingFailed(Exception):
     pass
 
 
-class EOF:
-    def __repr__(self) -> str:
-        return "EOF"
+T = TypeVar("T")
 
-    def __str__(self) -> str:
-        return "EOF"
 
+def require(value: T | None) -> T:
+    if value is None:
+        raise ParsingFailed()
+    return value
 
-class CursorEater(ABC):
-    text: str
 
-    def __init__(self, text: str) -> None:
-        self.text = text
+EOF = ""
 
-    @abstractmethod
-    def index(self) -> int:
-        ...
+IS_HEX, IS_DEC, IS_BIN, IS_QUOTE = 1, 2, 4, 8
 
-    @abstractmethod
-    def move(self, delta: int) -> None:
-        ...
 
-    def peek(self) -> str | EOF:
-        return self.text[self.index()] if self.index() < len(self.text) else EOF()
+def _class_bits(c: int) -> int:
+    bits = 0
+    if chr(c) in "0123456789abcdefABCDEF":
+        bits |= IS_HEX
+    if chr(c) in "0123456789":
+        bits |= IS_DEC
+    if chr(c) in "01":
+        bits |= IS_BIN
+    if chr(c) in "'\"":
+        bits |= IS_QUOTE
+    return bits
 
-    def eat_if(self, predicate: Callable[[str], bool], comment: str) -> str:
-        chr = self.peek()
-        if not isinstance(chr, EOF) and predicate(chr):
-            # print(f"Eat: At index {self.index} '{chr}' while parsing {comment}")
-            self.move(1)
-            return chr
 
-        # print(f"Raise EatFailed: At index {self.index} '{chr}' while parsing {comment}")
-        raise EatFailed(f"At index {self.index()} '{chr}' while parsing {comment}", failed_on_eof=isinstance(chr, EOF))
+CLASS = bytes(_class_bits(c) for c in range(256))
+
 
+def str_offsets(text: str) -> list[int] | None:
+    """Map byte offsets in the utf-8 encoding of text back to str offsets.
 
-@dataclass
-class Frame:
+    Returns None when the two coincide (pure-ASCII text).
+    """
+    if text.isascii():
+        return None
+
+    offsets: list[int] = []
+    for index, char in enumerate(text):
+        offsets.extend((index,) * len(char.encode("utf-8")))
+    offsets.append(len(text))
+    return offsets
+
+
+HEX_RUN = re.compile(rb"[0-9a-fA-F]+")
+BIN_RUN = re.compile(rb"[01]+")
+DEC_RUN = re.compile(rb"[0-9]+")
+
+
+class Frame(NamedTuple):
     start_index: int
     end_index: int
     text: str
@@ -73,172 +102,359 @@ class Frame:
         return self.end_index - self.start_index
 
     def token(self, ty: str) -> Token:
-        return Token(ty, self.value, self.start_index, self.end_index)
+        return Token(ty, self.text, self.start_index, self.end_index)
 
 
-class TransactionalCursor(CursorEater):
-    frames: list[Frame]
+class CursorEater:
+    text: str
+    _buf: bytes
+    _ends: list[int]
+    _offsets: list[int] | None
 
     def __init__(self, text: str) -> None:
-        super().__init__(text)
-        self.frames = []
+        self.text = text
+        self._buf = text.encode("utf-8")
+        self._offsets = str_offsets(text)
 
     def index(self) -> int:
-        return self.frames[-1].end_index
+        return self._ends[-1]
+
+    def str_index(self, index: int) -> int:
+        offsets = self._offsets
+        return index if offsets is None else offsets[index]
 
     def move(self, delta: int) -> None:
-        self.frames[-1].end_index += delta
+        self._ends[-1] += delta
+
+    def peek(self) -> str:
+        buf = self._buf
+        index = self._ends[-1]
+        return chr(buf[index]) if index < len(buf) else EOF
+
+    def eat_if(self, predicate: Callable[[str], bool], comment: str) -> str | None:
+        ends = self._ends
+        buf = self._buf
+        index = ends[-1]
+        if index < len(buf):
+            char = chr(buf[index])
+            if predicate(char):
+                ends[-1] = index + 1
+                return char
+
+        return None
+
+    def eat_class(self, mask: int, comment: str) -> str | None:
+        ends = self._ends
+        buf = self._buf
+        index = ends[-1]
+        if index < len(buf) and CLASS[buf[index]] & mask:
+            ends[-1] = index + 1
+            return chr(buf[index])
+
+        return None
+
+    def eat_regex(self, pattern: re.Pattern[bytes], comment: str) -> bytes | None:
+        ends = self._ends
+        match = pattern.match(self._buf, ends[-1])
+        if match is None:
+            return None
+
+        ends[-1] = match.end()
+        return match.group()
+
+    def eat_until(self, chr: str) -> str | None:
+        ends = self._ends
+        end = self._buf.find(ord(chr), ends[-1])
+        if end < 0:
+            return None
+
+        ends[-1] = end
+        return chr
+
+    def eat_only(self, chr: str) -> str | None:
+        ends = self._ends
+        buf = self._buf
+        index = ends[-1]
+        if index < len(buf) and buf[index] == ord(chr):
+            ends[-1] = index + 1
+            return chr
+
+        return None
+
+    def eat_any(self, lchr: str) -> str | None:
+        ends = self._ends
+        buf = self._buf
+        index = ends[-1]
+        if index < len(buf):
+            char = chr(buf[index])
+            if char in lchr:
+                ends[-1] = index + 1
+                return char
+
+        return None
+
+
+class TransactionalCursor(CursorEater):
+    _starts: list[int]
+    _scoped_pool: "list[ScopedCursor]"
+
+    def __init__(self, text: str) -> None:
+        super().__init__(text)
+        self._starts = [0]
+        self._ends = [0]
+        self._scoped_pool = []
 
     def commit(self) -> None:
-        if len(self.frames) > 1:
-            self.frames[-2].end_index = self.frames[-1].end_index
-        self.frames.pop()
+        end = self._ends.pop()
+        self._starts.pop()
+        if self._ends:
+            self._ends[-1] = end
 
     def rollback(self) -> None:
-        self.frames.pop()
+        self._starts.pop()
+        self._ends.pop()
 
-    def begin(self) -> Frame:
-        self.frames.append(Frame(self.index(), self.index(), self.text))
-        return self.frames[-1]
+    def begin(self) -> int:
+        index = self._ends[-1]
+        self._starts.append(index)
+        self._ends.append(index)
+        return index
 
+    def frame(self) -> Frame:
+        return Frame(self.str_index(self._starts[-1]), self.str_index(self._ends[-1]), self.text)
 
-# class FancyCursor(Cursor):
-#     def token(self, ty: str) -> Token:
-#         value = self.cursor.text[self.initial_index : self.cursor.index - self.initial_index]
-#         return Token(ty, value, self.initial_index, self.cursor.index - 1)
 
-#     def eat(self) -> str:
-#         return self.eat_if(lambda _: True, "any char")
+class ScopedCursor(CursorEater):
+    start_index: int
 
-#     def eat_only(self, chr: str) -> str:
-#         return self.eat_if(lambda c: c == chr, f"only '{chr}'")
+    def __init__(self, cursor: TransactionalCursor, start_index: int) -> None:
+        self.text = cursor.text
+        self._buf = cursor._buf
+        self._ends = cursor._ends
+        self._offsets = cursor._offsets
+        self.start_index = start_index
 
-#     def eat_any(self, lchr: str) -> str:
-#         return self.eat_if(lambda c: c in lchr, f"any of '{lchr}'")
+    def token(self, ty: str) -> Token:
+        return Frame(self.str_index(self.start_index), self.str_index(self._ends[-1]), self.text).token(ty)
 
 
-@contextmanager
-def transaction(cursor: TransactionalCursor) -> Generator[Frame, None, None]:
-    try:
-        yield cursor.begin()
-    except:
-        cursor.rollback()
-        raise
+class transaction:
+    __slots__ = ("cursor",)
 
-    cursor.commit()
+    def __init__(self, cursor: TransactionalCursor) -> None:
+        self.cursor = cursor
 
+    def __enter__(self) -> int:
+        return self.cursor.begin()
 
-@contextmanager
-def guard(eof_only: bool = False) -> Generator[None, None, None]:
-    try:
-        yield
-    except EatFailed as e:
-        if e.failed_on_eof or not eof_only:
-            pass
+    def __exit__(
+        self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None
+    ) -> Literal[False]:
+        if exc_type is None:
+            self.cursor.commit()
         else:
-            raise
+            self.cursor.rollback()
+        return False
 
 
-Parser = Callable[[Cursor], Token]
+class scoped:
+    __slots__ = ("cursor", "view")
 
+    def __init__(self, cursor: TransactionalCursor) -> None:
+        self.cursor = cursor
 
-class ParserRegistry:
-    parsers: list[Parser]
+    def __enter__(self) -> ScopedCursor:
+        cursor = self.cursor
+        pool = cursor._scoped_pool
+        if pool:
+            view = pool.pop()
+            view.start_index = cursor.begin()
+        else:
+            view = ScopedCursor(cursor, cursor.begin())
+        self.view = view
+        return view
+
+    def __exit__(
+        self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None
+    ) -> Literal[False]:
+        if exc_type is None:
+            self.cursor.commit()
+        else:
+            self.cursor.rollback()
+        # The view is only mutated again on the next __enter__, after any
+        # pending token() call on it has been made.
+        self.cursor._scoped_pool.append(self.view)
+        return False
 
-    def __init__(self) -> None:
-        self.parsers = []
 
-    def register(self, parser: Parser) -> Parser:
-        print(f"Registering {parser}")
-        self.parsers.append(parser)
-        return parser
+class guard:
+    __slots__ = ()
 
+    def __enter__(self) -> None:
+        return None
 
-parser_registry = ParserRegistry()
+    def __exit__(
+        self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None
+    ) -> bool:
+        return exc_type is not None and issubclass(exc_type, ParsingFailed)
 
 
-@parser_registry.register
-def p_str(cursor: Cursor) -> Token:
-    with scoped(cursor) as scoped_cursor:
-        quote = scoped_cursor.eat_any("'\"")
-        with guard():
-            while scoped_cursor.eat_if(lambda c: c != quote, f"anything but {quote}"):
-                pass
-        scoped_cursor.eat_only(quote)
+Parser = Callable[[TransactionalCursor], Token]
 
-    return scoped_cursor.token("STRING")
 
+class ParserRegistry:
+    RESORT_INTERVAL = 1024
 
-@parser_registry.register
-def p_dot(cursor: Cursor) -> Token:
-    with scoped(cursor) as scoped_cursor:
-        scoped_cursor.eat_only(".")
+    parsers: list[Parser]
+    _table: list[list[Parser]]
+    _dispatch: Parser | None
+    _hits: dict[Parser, int]
+    _recorded: int
 
-    return scoped_cursor.token("DOT")
+    def __init__(self) -> None:
+        self.parsers = []
+        self._table = [[] for _ in range(256)]
+        self._dispatch = None
+        self._hits = {}
+        self._recorded = 0
+
+    def register(self, first_chars: str) -> Callable[[Parser], Parser]:
+        def decorator(parser: Parser) -> Parser:
+            self.parsers.append(parser)
+            for chr in first_chars:
+                self._table[ord(chr)].append(parser)
+            self._dispatch = None
+            return parser
+
+        return decorator
+
+    def candidates(self, chr: str) -> list[Parser]:
+        if not chr:
+            return []
+        code = ord(chr)
+        return self._table[code] if code < 256 else []
+
+    def record_hit(self, parser: Parser) -> None:
+        self._hits[parser] = self._hits.get(parser, 0) + 1
+        self._recorded += 1
+        if self._recorded >= self.RESORT_INTERVAL:
+            self._resort()
+
+    def _resort(self) -> None:
+        self._recorded = 0
+        hits = self._hits
+        for bucket in self._table:
+            if len(bucket) > 1:
+                bucket.sort(key=lambda parser: hits.get(parser, 0), reverse=True)
+        self._dispatch = None
+
+    def finalize(self) -> Parser:
+        """Compile the dispatch table into one straight-line function.
+
+        The generated function switches on the character under the
+        cursor with inline calls to the registered parsers, so a token
+        costs neither a bucket lookup nor a loop over candidates.
+        Multi-candidate buckets record which parser won so _resort can
+        reorder them by observed frequency.
+        """
+        lines = ["def dispatch(cursor):", "    chr = cursor.peek()"]
+        namespace: dict[str, object] = {"ParsingFailed": ParsingFailed, "registry": self}
+        branch = "if"
+        for code, bucket in enumerate(self._table):
+            if not bucket:
+                continue
+            lines.append(f"    {branch} chr == {chr(code)!r}:")
+            branch = "elif"
+            if len(bucket) == 1:
+                name = bucket[0].__name__
+                namespace[name] = bucket[0]
+                lines.append(f"        return {name}(cursor)")
+                continue
+            for position, parser in enumerate(bucket):
+                name = parser.__name__
+                namespace[name] = parser
+                indent = "        "
+                if position + 1 < len(bucket):
+                    lines.append(f"{indent}try:")
+                    indent += "    "
+                lines.append(f"{indent}token = {name}(cursor)")
+                lines.append(f"{indent}registry.record_hit({name})")
+                lines.append(f"{indent}return token")
+                if position + 1 < len(bucket):
+                    lines.append("        except ParsingFailed:")
+                    lines.append("            pass")
+        lines.append("    raise ParsingFailed()")
+        exec(compile("\n".join(lines), "<dispatch>", "exec"), namespace)
+        self._dispatch = namespace["dispatch"]  # type: ignore[assignment]
+        return self._dispatch  # type: ignore[return-value]
 
 
-@parser_registry.register
-def p_hex(cursor: Cursor) -> Token:
-    with scoped(cursor) as scoped_cursor:
-        scoped_cursor.eat_only("0")
-        scoped_cursor.eat_only("x")
-        scoped_cursor.eat_if(lambda c: c in "0123456789abcdefABCDEF", "hex digit")
+parser_registry = ParserRegistry()
 
-        with guard():
-            while scoped_cursor.eat_if(lambda c: c in "0123456789abcdefABCDEF", "hex digit"):
-                pass
 
-    return scoped_cursor.token("HEX")
+@parser_registry.register("'\"")
+def p_str(cursor: TransactionalCursor) -> Token:
+    with scoped(cursor) as scoped_cursor:
+        quote = require(scoped_cursor.eat_class(IS_QUOTE, "quote"))
+        require(scoped_cursor.eat_until(quote))
+        require(scoped_cursor.eat_only(quote))
 
+    return scoped_cursor.token("STRING")
 
-@parser_registry.register
-def p_bin(cursor: Cursor) -> Token:
-    with scoped(cursor) as scoped_cursor:
-        scoped_cursor.eat_only("0")
-        scoped_cursor.eat_only("b")
-        scoped_cursor.eat_if(lambda c: c in "01", "bin digit")
 
-        with guard():
-            while scoped_cursor.eat_if(lambda c: c in "01", "bin digit"):
-                pass
+@parser_registry.register(".")
+def p_dot(cursor: TransactionalCursor) -> Token:
+    with scoped(cursor) as scoped_cursor:
+        require(scoped_cursor.eat_only("."))
 
-    return scoped_cursor.token("BIN")
+    return scoped_cursor.token("DOT")
 
 
-@parser_registry.register
-def p_dec(cursor: Cursor) -> Token:
+@parser_registry.register("0123456789")
+def p_number(cursor: TransactionalCursor) -> Token:
     with scoped(cursor) as scoped_cursor:
-        scoped_cursor.eat_if(lambda c: c in "0123456789", "dec digit")
-
-        with guard():
-            while scoped_cursor.eat_if(lambda c: c in "0123456789", "dec digit"):
-                pass
+        first = require(scoped_cursor.eat_class(IS_DEC, "dec digit"))
+
+        if first == "0" and scoped_cursor.eat_only("x") is not None:
+            require(scoped_cursor.eat_regex(HEX_RUN, "hex digits"))
+            ty = "HEX"
+        elif first == "0" and scoped_cursor.eat_only("b") is not None:
+            require(scoped_cursor.eat_regex(BIN_RUN, "bin digits"))
+            ty = "BIN"
+        else:
+            scoped_cursor.eat_regex(DEC_RUN, "dec digits")
 
-        if scoped_cursor.peek() == ".":
-            scoped_cursor.eat_only(".")
-            scoped_cursor.eat_if(lambda c: c in "0123456789", "dec digit")
             with guard():
-                while scoped_cursor.eat_if(lambda c: c in "0123456789", "dec digit"):
-                    pass
+                with transaction(cursor):
+                    require(scoped_cursor.eat_only("."))
+                    require(scoped_cursor.eat_regex(DEC_RUN, "dec digits"))
+
+            ty = "DEC"
 
-    return scoped_cursor.token("DEC")
+    return scoped_cursor.token(ty)
 
 
-def first_parser(parsers: list[Parser], cursor: Cursor) -> Token:
-    for parser in parsers:
+def first_parser(registry: ParserRegistry, cursor: TransactionalCursor) -> Token:
+    for parser in registry.candidates(cursor.peek()):
         try:
-            return parser(cursor)
+            token = parser(cursor)
         except ParsingFailed:
-            pass
+            continue
+        registry.record_hit(parser)
+        return token
     raise ParsingFailed()
 
 
-def root_parser(cursor: Cursor) -> Generator[Token, None, None]:
-    print(f"Root parser has {len(parser_registry.parsers)} parsers")
-    while not isinstance(cursor.peek(), EOF):
-        yield first_parser(parser_registry.parsers, cursor)
+def root_parser(cursor: TransactionalCursor) -> Generator[Token, None, None]:
+    registry = parser_registry
+    while cursor.peek():
+        dispatch = registry._dispatch
+        if dispatch is None:
+            dispatch = registry.finalize()
+        yield dispatch(cursor)
 
 
-cursor = Cursor("1..2.2123")
-for token in root_parser(cursor):
-    print(token)
+if __name__ == "__main__":
+    cursor = TransactionalCursor("1..2.2123")
+    for token in root_parser(cursor):
+        print(token)